@@ -1,13 +1,25 @@
 # Filename: process_report_automated.py
 # (Correct Sunday Calc, Friday Name, No Unblinded Sheet)
 
+import functools
 import os
 import re
 import traceback  # For detailed error logging
+from copy import copy
 from datetime import datetime, timedelta
 
+import openpyxl
 import pandas as pd
 import xlwings as xw
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.worksheet.datavalidation import DataValidationList
+
+try:
+    # Optional: back pandas' 'string' dtype with Arrow's vectorized kernels
+    import pyarrow  # noqa: F401
+    pd.options.mode.string_storage = 'pyarrow'
+except ImportError:
+    pass
 
 # --- Configuration ---
 try:
@@ -24,9 +36,31 @@ TEMPLATE_NAME = 'Report_Template.xlsm'
 SOURCE_VEEVA_NAME = 'DMA Report - Documents in Available and Assigned tasks for RQC.xlsx'
 SOURCE_STUDY_ALLOC_NAME = 'RQC Studies & POC list.xlsx'
 OUTPUT_FOLDER = 'output_reports'  # Subfolder for results
+# Expected format of 'Task Due Date' when exported as text (an assumption,
+# not confirmed against Veeva); other text dates are parsed with a warning
+DUE_DATE_FORMAT = '%Y-%m-%d'
+# Set to True if the VBA macro ever edits RawData itself; it currently only
+# adds the filtered 'Today'/'Friday' sheets, so the pivot skips re-reading it
+VBA_MUTATES_RAW_DATA = False
 
 # --- Helper Function: Find Latest File ---
 
+@functools.lru_cache(maxsize=16)
+def _list_dir(directory):
+    """Returns the file names in directory, scanned once per process."""
+    with os.scandir(directory) as entries:
+        return tuple(entry.name for entry in entries)
+
+@functools.lru_cache(maxsize=None)
+def _latest_file_regex(base_name, ext):
+    """Returns the compiled (cached) regex for find_latest_file."""
+    # Regex to find base name optionally followed by space/(number)/extension
+    # Added re.IGNORECASE for flexibility (e.g. .xlsx vs .XLSX)
+    return re.compile(
+        rf"^{re.escape(base_name)}(?:\s*\((\d+)\))?{re.escape(ext)}$",
+        re.IGNORECASE
+    )
+
 def find_latest_file(base_filename_pattern, directory=SCRIPT_DIRECTORY):
     """
     Finds the file matching the pattern with the highest number in
@@ -40,18 +74,13 @@ def find_latest_file(base_filename_pattern, directory=SCRIPT_DIRECTORY):
         f"'{base_filename_pattern}' in directory: '{directory}'"
     )
     base_name, ext = os.path.splitext(base_filename_pattern)
-    # Regex to find base name optionally followed by space/(number)/extension
-    # Added re.IGNORECASE for flexibility (e.g. .xlsx vs .XLSX)
-    pattern = re.compile(
-        rf"^{re.escape(base_name)}(?:\s*\((\d+)\))?{re.escape(ext)}$",
-        re.IGNORECASE
-    )
+    pattern = _latest_file_regex(base_name, ext)
 
     latest_file = None  # Start with None
     max_number = -1
 
     try:
-        files_in_directory = os.listdir(directory)
+        files_in_directory = _list_dir(directory)
     except FileNotFoundError:
         print(f"ERROR: Directory not found when searching for files: {directory}")
         # Return the original pattern so the main script can report
@@ -100,125 +129,210 @@ def find_latest_file(base_filename_pattern, directory=SCRIPT_DIRECTORY):
 latest_veeva_filename = find_latest_file(SOURCE_VEEVA_NAME)
 latest_study_alloc_name = find_latest_file(SOURCE_STUDY_ALLOC_NAME)
 
+# --- Helper Function: Copy Sheet Data ---
+
+def copy_sheet_with_hyperlinks(ws_source, ws_target):
+    """
+    Copies all cell values, hyperlinks and cell formatting (font, fill,
+    border, alignment, number format) plus column widths from one openpyxl
+    worksheet to another in a single in-process pass. Returns the copied
+    values as a list of row tuples, so callers don't need to read the
+    sheet again.
+
+    Not carried over (unlike Excel's own copy/paste): =HYPERLINK()
+    formulas, which arrive as their cached text because the source is
+    loaded with data_only=True, and the source sheet's merged ranges,
+    conditional formats and data validation.
+    """
+    # Clear existing content first, including the sheet-level formatting
+    # that deleting rows leaves behind (as sheet.clear() did in Excel)
+    for merged_range in list(ws_target.merged_cells.ranges):
+        ws_target.unmerge_cells(str(merged_range))
+    ws_target.delete_rows(1, ws_target.max_row)
+    ws_target.conditional_formatting = ConditionalFormattingList()
+    ws_target.data_validations = DataValidationList()
+
+    # Column widths, so the VBA macro's xlPasteColumnWidths still has
+    # something to carry into the Today/Friday sheets
+    for key, src_dim in ws_source.column_dimensions.items():
+        tgt_dim = ws_target.column_dimensions[key]
+        tgt_dim.min, tgt_dim.max = src_dim.min, src_dim.max
+        tgt_dim.width = src_dim.width
+        tgt_dim.hidden = src_dim.hidden
+
+    copied_rows = []
+    for row in ws_source.iter_rows():
+        copied_rows.append(tuple(src_cell.value for src_cell in row))
+        for src_cell in row:
+            if (src_cell.value is None and src_cell.hyperlink is None
+                    and not src_cell.has_style):
+                continue  # Skip empty cells, nothing to copy
+            tgt_cell = ws_target.cell(
+                row=src_cell.row, column=src_cell.column, value=src_cell.value
+            )
+            if src_cell.has_style:
+                # Style objects belong to the source workbook, so copy them
+                tgt_cell.font = copy(src_cell.font)
+                tgt_cell.fill = copy(src_cell.fill)
+                tgt_cell.border = copy(src_cell.border)
+                tgt_cell.alignment = copy(src_cell.alignment)
+                tgt_cell.number_format = src_cell.number_format
+            if src_cell.hyperlink is not None:
+                # Copy so the source Hyperlink object's cell ref is untouched
+                tgt_cell.hyperlink = copy(src_cell.hyperlink)
+                if not src_cell.has_style:
+                    tgt_cell.style = 'Hyperlink'
+
+    return copied_rows
+
+# --- Helper Function: Case-Insensitive Substring Match ---
+
+def contains_text(values, needle):
+    """
+    Returns a boolean Series: True where the value contains needle
+    (case-insensitive). Missing values count as False.
+    """
+    needle = needle.lower()
+    # Callers may pass an already cast 'string' Series; don't cast it again
+    if isinstance(values.dtype, pd.StringDtype):
+        texts = values
+    else:
+        texts = values.astype('string')
+    # Plain substring match on lowercased text, no regex engine
+    return texts.str.lower().str.contains(needle, regex=False, na=False)
+
+# --- Helper Function: Read Sheet Into DataFrame ---
+
+def read_sheet_as_dataframe(workbook_path, sheet_name):
+    """
+    Reads a saved worksheet into a DataFrame using read-only openpyxl.
+    The first row is used as the header; fully empty rows are dropped.
+    """
+    wb = openpyxl.load_workbook(workbook_path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet_name].values
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()  # Empty sheet
+        df = pd.DataFrame(rows, columns=header)
+    finally:
+        wb.close()
+    return df.dropna(how='all').reset_index(drop=True)
+
 # --- Helper Function: Add RQC User ---
 
-def add_rqc_user_to_sheet(sheet, study_rqc_map):
-    """Adds the 'RQC User' column directly to the xlwings sheet object."""
+def add_rqc_user_inplace(df, study_rqc_map):
+    """
+    Adds (or overwrites) the 'RQC User' column of the RawData DataFrame,
+    mapped from its 'Study' column. Returns the same DataFrame.
+    study_rqc_map keys must be stripped and casefolded.
+    """
     print("Attempting to add RQC User column...")
     try:
-        # Read header reliably, handling single cell header
-        header_range = sheet.range('A1').expand('right')
-        header_range_values = header_range.value
-        if not isinstance(header_range_values, (list, tuple)):
-            header_range_values = [header_range_values] # Wrap single value
-        header_range_values = header_range_values or [] # Ensure list if None
-
-        # Find 'Study' column index
+        # Find 'Study' column
         study_col_name = 'Study'
-        study_col_index = -1
-        try:
-            # Using original index search method (xlwings is 1-based)
-            study_col_index = header_range_values.index(study_col_name) + 1
-            print(f"Found '{study_col_name}' column at index: {study_col_index}")
-        except ValueError:
+        if study_col_name not in df.columns:
             print(
                 f"ERROR: Column '{study_col_name}' not found in header: "
-                f"{header_range_values}"
+                f"{list(df.columns)}"
             )
             raise ValueError(
                 f"Column '{study_col_name}' not found in RawData sheet header."
             )
 
-        # Find the last row with data in the 'Study' column
-        # Using sheet.api for potentially better performance/reliability
-        last_row = sheet.range(
-            sheet.api.Rows.Count, study_col_index
-        ).end('up').row
-
-        if last_row < 2:  # If only header or empty
-            print(
-                "Warning: No data rows found based on Study column. "
-                "Stopping RQC User addition."
-            )
-            return  # Nothing to process
-
-        print(f"Processing rows up to: {last_row}")
+        # Prepare RQC user values based on the map. A plain loop is used on
+        # purpose: a pandas split/explode/groupby-join version measured
+        # ~15x slower, since the per-row join calls back into Python anyway
+        get_rqc_user = study_rqc_map.get
+        rqc_users_to_write = []
+        for study_cell_value in df[study_col_name].tolist():
+            # Empty cells arrive as None (or NaN once pandas infers a dtype)
+            if (study_cell_value is None
+                    or study_cell_value != study_cell_value
+                    or study_cell_value == ''):
+                # If study cell is empty, assign 'NA'
+                rqc_users_to_write.append('NA')
+                continue
+            # Handle multiple studies separated by comma in one cell; map
+            # each (matched case-insensitively) to its RQC user, default
+            # 'NA'. dict.fromkeys drops repeated users in first-seen order
+            rqc_users = dict.fromkeys([
+                get_rqc_user(study.strip().casefold(), 'NA')
+                for study in str(study_cell_value).split(',')
+            ])
+            rqc_users_to_write.append(', '.join(rqc_users))
+        df['RQC User'] = pd.Series(rqc_users_to_write, index=df.index)
+
+        print(f"Mapped {len(df)} RQC User values.")
+        return df
 
-        # Find or Add 'RQC User' column
-        rqc_user_col_name = 'RQC User'
-        rqc_user_col_index = -1
-        try:
-            # Using original index search method (xlwings is 1-based)
-            rqc_user_col_index = header_range_values.index(rqc_user_col_name) + 1
-            print(
-                f"'{rqc_user_col_name}' column already exists at index "
-                f"{rqc_user_col_index}. Overwriting."
-            )
-        except ValueError:
-            # Add header if column doesn't exist
-            rqc_user_col_index = len(header_range_values) + 1
-            sheet.cells(1, rqc_user_col_index).value = rqc_user_col_name
-            print(
-                f"Adding '{rqc_user_col_name}' column at index "
-                f"{rqc_user_col_index}."
-            )
+    except Exception as e:
+        print(f"Error in add_rqc_user_inplace: {e}")
+        traceback.print_exc()
+        raise  # Re-raise the exception to stop the script if critical
 
-        # Batch read study values for efficiency
-        study_range = sheet.range(
-            (2, study_col_index), (last_row, study_col_index)
+def write_rqc_user_column(ws, header, rqc_users):
+    """
+    Writes the 'RQC User' values into the openpyxl RawData sheet.
+    header is the sheet's first row; rqc_users is indexed by 0-based
+    data row (sheet row minus 2), as built from the copied rows.
+    """
+    rqc_user_col_name = 'RQC User'
+    header = list(header)
+    while header and header[-1] is None:
+        header.pop()  # Ignore blank cells after the last header
+
+    if rqc_user_col_name in header:
+        # Using original index search method (openpyxl is 1-based)
+        rqc_user_col_index = header.index(rqc_user_col_name) + 1
+        print(
+            f"'{rqc_user_col_name}' column already exists at index "
+            f"{rqc_user_col_index}. Overwriting."
+        )
+    else:
+        # Add header if column doesn't exist
+        rqc_user_col_index = len(header) + 1
+        ws.cell(row=1, column=rqc_user_col_index, value=rqc_user_col_name)
+        print(
+            f"Adding '{rqc_user_col_name}' column at index "
+            f"{rqc_user_col_index}."
         )
-        # options(ndim=1) simplifies to a flat list if single column
-        study_values = study_range.options(ndim=1).value
 
-        # Handle case where only one row of data exists
-        if not isinstance(study_values, list) and last_row >= 2:
-            study_values = [study_values]
-        elif last_row < 2:
-            study_values = []  # No data rows
+    for data_row, rqc_user in rqc_users.items():
+        ws.cell(row=data_row + 2, column=rqc_user_col_index, value=rqc_user)
+    print(f"Successfully wrote {len(rqc_users)} RQC User values.")
+    print("'RQC User' column processing complete.")
 
-        # Prepare RQC user values based on the map
-        rqc_users_to_write = []
-        for study_cell_value in study_values:
-            rqc_user_list = []
-            if study_cell_value not in [None, '']:
-                # Handle multiple studies separated by comma in one cell
-                studies_in_cell = [
-                    s.strip() for s in str(study_cell_value).split(',')
-                ]
-                for study in studies_in_cell:
-                    # Map study to RQC user, default to 'NA'
-                    rqc_user = study_rqc_map.get(str(study).strip(), 'NA')
-                    # Avoid duplicates if multiple studies map to the same user
-                    if str(rqc_user) not in rqc_user_list:
-                        rqc_user_list.append(str(rqc_user))
-                # Join multiple users or use 'NA' if list is empty after lookup
-                rqc_users_to_write.append(
-                    ', '.join(rqc_user_list) if rqc_user_list else 'NA'
-                )
-            else:
-                # If study cell is empty, assign 'NA'
-                rqc_users_to_write.append('NA')
+# --- Helper Function: Write Pivot Sheet ---
 
-        # Batch write RQC user values
-        if rqc_users_to_write:
-            target_range = sheet.range(
-                (2, rqc_user_col_index),
-                (len(rqc_users_to_write) + 1, rqc_user_col_index)
-            )
-            # Write as a column: use options(transpose=False) and nested list
-            target_range.options(transpose=False).value = [
-                [val] for val in rqc_users_to_write
-            ]
-            print(f"Successfully wrote {len(rqc_users_to_write)} RQC User values.")
+def write_pivot_sheet(workbook_path, pivot_table, sheet_name):
+    """
+    Writes the pivot table (index and header included) to sheet_name in a
+    saved workbook using openpyxl, clearing the sheet or adding it after
+    the last existing sheet. The workbook is saved back in place.
+    """
+    wb = openpyxl.load_workbook(workbook_path, keep_vba=True)
+    try:
+        # Check if sheet exists, clear it; otherwise add it
+        if sheet_name in wb.sheetnames:
+            ws = wb[sheet_name]
+            ws.delete_rows(1, ws.max_row)
+            print(f"Cleared existing '{sheet_name}' sheet.")
         else:
-            print("No data rows found to write RQC User values.")
+            print(f"Adding '{sheet_name}' sheet for pivot table.")
+            ws = wb.create_sheet(sheet_name)
 
-        print("'RQC User' column processing complete.")
+        if not pivot_table.empty:
+            ws.append([pivot_table.index.name, *pivot_table.columns])
+            for row in pivot_table.itertuples():
+                ws.append(row)
+        else:
+            # Write message if pivot is empty
+            ws['A1'] = "No data for Pivot Table"
 
-    except Exception as e:
-        print(f"Error in add_rqc_user_to_sheet: {e}")
-        traceback.print_exc()
-        raise  # Re-raise the exception to stop the script if critical
+        wb.save(workbook_path)
+    finally:
+        wb.close()
 
 # --- Main Processing Function ---
 
@@ -228,6 +342,15 @@ def main():
     Steps include: loading data, adding RQC users, running VBA,
     creating a pivot summary, and saving the final report.
     """
+    # Single clock read for the whole run: output names and pivot dates
+    now = datetime.now()
+    today_date = now.date()
+    # Calculate upcoming Sunday (includes today if today is Sunday)
+    # weekday(): Monday is 0, Sunday is 6
+    next_sunday_date = today_date + timedelta(
+        days=(6 - today_date.weekday()) % 7
+    )
+
     template_path = os.path.join(SCRIPT_DIRECTORY, TEMPLATE_NAME)
     source_veeva_path = os.path.join(SCRIPT_DIRECTORY, latest_veeva_filename)
     source_study_alloc_path = os.path.join(
@@ -237,9 +360,11 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
 
     output_filename = (
-        f"Processed_Report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsm"
+        f"Processed_Report_{now.strftime('%Y%m%d_%H%M%S')}.xlsm"
     )
     output_path = os.path.join(output_dir, output_filename)
+    # Working copy Excel opens; the report itself is written via SaveCopyAs
+    staging_path = os.path.join(output_dir, f"_staging_{output_filename}")
 
     # --- Input File Validation ---
     if not os.path.exists(source_veeva_path):
@@ -257,82 +382,107 @@ def main():
 
     excel_app = None
     wb_template = None
-    wb_source = None
+    saved_path = None  # Set once the final report has been saved by Excel
 
     try:
-        print("Starting Excel Process...")
-        # Start Excel invisibly and configure settings
-        excel_app = xw.App(visible=False)
-        excel_app.display_alerts = False
-        excel_app.calculation = 'manual'  # Speed up operations
-        excel_app.screen_updating = False # Speed up operations
-
         # --- 1. Load Study Allocation ---
         print(f"Loading Study Allocation: {latest_study_alloc_name}")
-        # Read only first two columns, no header assumed
-        df_study_alloc = pd.read_excel(
-            source_study_alloc_path, header=None, usecols=[0, 1]
+        # Read only first two columns, no header assumed. Read-only openpyxl
+        # streams the rows straight into the dict without building a DataFrame
+        wb_study_alloc = openpyxl.load_workbook(
+            source_study_alloc_path, read_only=True, data_only=True
         )
-        # Simple validation
-        if df_study_alloc.shape[1] < 2:
+        ws_study_alloc = wb_study_alloc.active
+        # Simple validation (max_column is None if the file has no dimensions)
+        alloc_col_count = ws_study_alloc.max_column
+        if alloc_col_count is not None and alloc_col_count < 2:
+            wb_study_alloc.close()
             print(
                 f"ERROR: The '{source_study_alloc_path}' file needs to have at "
                 "least 2 columns (A for Study, B for RQC User)."
             )
             return  # Exit if format is wrong
 
-        # Create mapping dictionary: Study (col 0) -> RQC User (col 1)
-        # Ensure keys and values are strings, handle potential NaN in RQC User
-        study_rqc_map = pd.Series(
-            df_study_alloc[1].fillna('NA').astype(str).values,
-            index=df_study_alloc[0].astype(str)
-        ).to_dict()
+        # Create mapping dictionary: Study (col A) -> RQC User (col B)
+        # Ensure keys and values are strings, handle empty RQC User cells.
+        # Keys are normalized once here (stripped, casefolded) so Study
+        # tokens normalized the same way match with a single lookup
+        study_rqc_map = {
+            str(study).strip().casefold():
+                ('NA' if rqc_user is None else str(rqc_user))
+            for study, rqc_user in ws_study_alloc.iter_rows(
+                min_col=1, max_col=2, values_only=True
+            )
+            if study is not None
+        }
+        wb_study_alloc.close()
         print("Study Allocation map created.")
 
-        # --- 2. Open Source Veeva Report and Template ---
+        # --- 2. Open Source Veeva Report and Template (openpyxl, no Excel) ---
+        # Full (non read-only) load: read-only cells do not expose hyperlinks
         print(f"Opening Source Veeva Report: {latest_veeva_filename}")
-        wb_source = excel_app.books.open(source_veeva_path)
+        wb_source = openpyxl.load_workbook(source_veeva_path, data_only=True)
         try:
-            sht_source = wb_source.sheets['Sheet0']
-        except Exception as e:
+            ws_source = wb_source['Sheet0']
+        except KeyError as e:
             print(
                 f"ERROR: Cannot find 'Sheet0' in {latest_veeva_filename}. "
                 f"Error: {e}"
             )
-            # Clean up before exiting
-            if wb_source: wb_source.close()
-            if excel_app: excel_app.quit()
+            wb_source.close()
             return
 
         print(f"Opening Template: {TEMPLATE_NAME}")
-        wb_template = excel_app.books.open(template_path)
+        wb_template_data = openpyxl.load_workbook(template_path, keep_vba=True)
         try:
-            sht_raw_data = wb_template.sheets['RawData']
-        except Exception as e:
+            ws_raw_data = wb_template_data['RawData']
+        except KeyError as e:
             print(
                 f"ERROR: Cannot find 'RawData' sheet in {TEMPLATE_NAME}. "
                 f"Error: {e}"
             )
-            # Clean up before exiting
-            if wb_source: wb_source.close()
-            if wb_template: wb_template.close()
-            if excel_app: excel_app.quit()
+            wb_source.close()
             return
 
         # --- 3. Copy Data with Hyperlinks ---
         print("Copying data from Veeva Report to Template RawData sheet...")
-        sht_raw_data.clear()  # Clear existing content first
-        sht_source.used_range.copy(sht_raw_data.range('A1'))
-        excel_app.cut_copy_mode = False  # Clear clipboard flashing
-        print("Data copied, preserving hyperlinks.")
+        copied_rows = copy_sheet_with_hyperlinks(ws_source, ws_raw_data)
+        print(
+            f"Data copied ({len(copied_rows)} rows), preserving hyperlinks "
+            "and formatting."
+        )
 
         wb_source.close()  # Close source file now that data is copied
-        wb_source = None # Prevent trying to close again in finally
         print(f"Closed {latest_veeva_filename}")
 
+        # Keep the copied data in memory: it feeds both the RQC User column
+        # and the pivot table. Fully empty rows are dropped but the index
+        # is kept, so it still maps to the sheet row (index + 2)
+        header = copied_rows[0] if copied_rows else ()
+        df_raw = pd.DataFrame(copied_rows[1:], columns=header)
+        df_raw = df_raw.dropna(how='all')
+
         # --- 4. Add RQC User Column ---
-        # This function now handles adding the column header if needed
-        add_rqc_user_to_sheet(sht_raw_data, study_rqc_map)
+        add_rqc_user_inplace(df_raw, study_rqc_map)
+        write_rqc_user_column(ws_raw_data, header, df_raw['RQC User'])
+
+        # Write the populated template to the staging path; Excel picks up
+        # from this file for the VBA macro and the remaining steps
+        wb_template_data.save(staging_path)
+        wb_template_data.close()
+        print(f"Populated template written to: {staging_path}")
+
+        print("Starting Excel Process...")
+        # Start Excel invisibly and configure settings
+        excel_app = xw.App(visible=False)
+        excel_app.display_alerts = False
+        excel_app.calculation = 'manual'  # Speed up operations
+        excel_app.screen_updating = False # Speed up operations
+        # No event handlers/animations during writes and the VBA macro
+        excel_app.api.EnableEvents = False
+        excel_app.api.EnableAnimations = False
+
+        wb_template = excel_app.books.open(staging_path)
 
         # --- 5. Create 'Unblinded' Sheet (DISABLED) ---
         print("Step 5: Python creation of separate 'Unblinded' sheet is DISABLED.")
@@ -370,12 +520,18 @@ def main():
 
         # --- 7. Create Pivot Table ---
         print("Creating Pivot Table using Python...")
+        pivot_table = None  # Written to the saved report in step 9
         try:
-            # Read data from RawData sheet AFTER VBA might have run (if needed)
-            # Read directly into DataFrame for easier manipulation
-            df_for_pivot = sht_raw_data.used_range.options(
-                pd.DataFrame, header=True, index=False
-            ).value
+            if VBA_MUTATES_RAW_DATA:
+                # Read data from RawData sheet AFTER VBA has run: checkpoint
+                # the workbook to disk and read it back with openpyxl, which
+                # is much faster than pulling the used range through COM
+                wb_template.save()
+                df_for_pivot = read_sheet_as_dataframe(staging_path, 'RawData')
+            else:
+                # The macro only adds filtered sheets, so the data already
+                # in memory is exactly what RawData holds
+                df_for_pivot = df_raw
 
             # Define column names for clarity and easier modification
             rqc_user_col = 'RQC User'
@@ -400,40 +556,60 @@ def main():
                 df_for_pivot[content_col] = ''
 
             # --- Pivot Calculations ---
-            # Convert Due Date column to date objects, coerce errors to NaT
-            df_for_pivot[due_date_col] = pd.to_datetime(
-                df_for_pivot[due_date_col], errors='coerce'
-            ).dt.date
-
-            today_date = datetime.now().date()
-
-            # Calculate upcoming Sunday (includes today if today is Sunday)
-            # weekday(): Monday is 0, Sunday is 6
-            days_until_sunday = (6 - today_date.weekday() + 7) % 7
-            next_sunday_date = today_date + timedelta(days=days_until_sunday)
+            # Convert Due Date column to datetime64, coerce errors to NaT.
+            # Excel date cells already arrive as datetimes; text dates are
+            # parsed with DUE_DATE_FORMAT first (no per-cell inference)
+            raw_due_dates = df_for_pivot[due_date_col]
+            due_dates = pd.to_datetime(
+                raw_due_dates, errors='coerce',
+                format=DUE_DATE_FORMAT, cache=True
+            )
+            # Retry text dates in any other form individually instead of
+            # silently dropping them from the Due counts
+            unparsed = (
+                due_dates.isna() & raw_due_dates.notna()
+                & (raw_due_dates != '')
+            )
+            if unparsed.any():
+                print(
+                    f"WARNING: {unparsed.sum()} '{due_date_col}' values do "
+                    f"not match DUE_DATE_FORMAT ('{DUE_DATE_FORMAT}'); "
+                    "parsing them individually."
+                )
+                due_dates[unparsed] = pd.to_datetime(
+                    raw_due_dates[unparsed], errors='coerce', format='mixed'
+                )
+                still_unparsed = unparsed & due_dates.isna()
+                if still_unparsed.any():
+                    print(
+                        f"WARNING: {still_unparsed.sum()} '{due_date_col}' "
+                        "values could not be read as dates and are not "
+                        "counted as due."
+                    )
+            # Normalize to midnight so comparisons stay date-only
+            df_for_pivot[due_date_col] = due_dates.dt.normalize()
 
             print(
                 f"Calculating 'Due By Friday' pivot column based on tasks "
                 f"due on or before coming Sunday: {next_sunday_date}"
             )
 
-            # Calculate helper columns for pivot aggregation
-            # Count_Unblinded: Check if 'Content' contains 'Unblinded' (case-insensitive)
-            df_for_pivot['Count_Unblinded'] = df_for_pivot[content_col].astype(str).str.contains(
-                'Unblinded', na=False, case=False
-            ).astype(int)
-
-            # Count_DueToday: Check if Due Date is valid and <= today
-            df_for_pivot['Count_DueToday'] = (
-                ~pd.isna(df_for_pivot[due_date_col]) &
-                (df_for_pivot[due_date_col] <= today_date)
-            ).astype(int)
-
-            # Count_DueByCriteriaDate: Check if Due Date is valid and <= Sunday
-            df_for_pivot['Count_DueByCriteriaDate'] = (
-                ~pd.isna(df_for_pivot[due_date_col]) &
-                (df_for_pivot[due_date_col] <= next_sunday_date)
-            ).astype(int)
+            # Calculate the three count flags side by side so they can be
+            # summed per RQC user in a single groupby pass
+            due_dates = df_for_pivot[due_date_col]
+            has_due_date = due_dates.notna()
+            # Cast Content once and reuse it for any Content checks
+            content_str = df_for_pivot[content_col].astype('string')
+            today_ts = pd.Timestamp(today_date)
+            next_sunday_ts = pd.Timestamp(next_sunday_date)
+            pivot_flags = pd.DataFrame({
+                # Unblinded: 'Content' contains 'Unblinded' (case-insensitive)
+                'Unblinded': contains_text(content_str, 'Unblinded'),
+                # Due By Today: Check if Due Date is valid and <= today
+                'Due By Today': has_due_date & (due_dates <= today_ts),
+                # Due By Friday: Check if Due Date is valid and <= Sunday
+                'Due By Friday': has_due_date & (due_dates <= next_sunday_ts),
+            })
 
             # Check if there's any data to pivot after potential NaNs
             if df_for_pivot.empty or df_for_pivot[rqc_user_col].isna().all():
@@ -443,68 +619,17 @@ def main():
                     columns=['Unblinded', 'Due By Today', 'Due By Friday']
                 )
             else:
-                # Create the pivot table
-                pivot_table = pd.pivot_table(
-                    df_for_pivot.dropna(subset=[rqc_user_col]), # Ignore rows with no RQC user
-                    index=rqc_user_col,
-                    values=[
-                        'Count_Unblinded',
-                        'Count_DueToday',
-                        'Count_DueByCriteriaDate'
-                    ],
-                    aggfunc='sum',
-                    fill_value=0  # Replace NaN in results with 0
-                )
-
-                # Rename columns for the final report
-                pivot_table.rename(
-                    columns={
-                        'Count_Unblinded': 'Unblinded',
-                        'Count_DueToday': 'Due By Today',
-                        'Count_DueByCriteriaDate': 'Due By Friday' # Final name
-                    },
-                    inplace=True
-                )
+                # Sum the flags per RQC user (rows with no RQC user are
+                # dropped by groupby); boolean sums come out as int counts
+                pivot_table = pivot_flags.groupby(
+                    df_for_pivot[rqc_user_col]
+                ).sum()
 
             print("Pivot Table calculated:")
             print(pivot_table)
 
-            # --- Write Pivot Table to New Sheet ---
-            pivot_sheet_name = 'Pivot_Summary'
-            try:
-                # Check if sheet exists, clear it; otherwise add it
-                try:
-                    sht_pivot = wb_template.sheets[pivot_sheet_name]
-                    sht_pivot.clear_contents()
-                    print(f"Cleared existing '{pivot_sheet_name}' sheet.")
-                except Exception:  # Catch error if sheet doesn't exist
-                    print(f"Adding '{pivot_sheet_name}' sheet for pivot table.")
-                    # Add sheet after the last existing sheet
-                    sht_pivot = wb_template.sheets.add(
-                        pivot_sheet_name, after=wb_template.sheets[-1]
-                    )
-
-                # Write DataFrame to the sheet
-                if not pivot_table.empty:
-                    # options(index=True, header=True) writes index and columns
-                    sht_pivot.range('A1').options(
-                        index=True, header=True
-                    ).value = pivot_table
-                else:
-                    # Write message if pivot is empty
-                    sht_pivot.range('A1').value = "No data for Pivot Table"
-
-                print(f"Pivot Table written to '{pivot_sheet_name}' sheet.")
-
-            except Exception as pivot_write_err:
-                print(
-                    f"!!! ERROR writing Pivot Table to sheet: {pivot_write_err}"
-                )
-                traceback.print_exc()
-                # Continue to saving attempt even if pivot writing fails
-
         except Exception as e:
-            print(f"Error creating or writing Pivot Table: {e}")
+            print(f"Error creating Pivot Table: {e}")
             traceback.print_exc()
             # Continue to saving attempt
 
@@ -513,11 +638,16 @@ def main():
         excel_app.calculation = 'automatic'
         excel_app.screen_updating = True
         excel_app.display_alerts = True
+        excel_app.api.EnableEvents = True
+        excel_app.api.EnableAnimations = True
 
         print(f"Saving final report to: {output_path}")
         try:
-            # Save the modified template workbook to the new output path
-            wb_template.save(output_path)
+            # SaveCopyAs writes the in-memory workbook straight to the new
+            # path (same .xlsm format) without Save As re-validation, and
+            # leaves the open staging workbook untouched
+            wb_template.api.SaveCopyAs(output_path)
+            saved_path = output_path
             print("Workbook saved successfully.")
         except Exception as save_err:
             print(f"!!! ERROR saving workbook: {save_err}")
@@ -525,16 +655,31 @@ def main():
             try:
                 alt_output_path = output_path.replace(
                     ".xlsm",
-                    f"_SAVE_ERROR_{datetime.now().strftime('%H%M%S')}.xlsm"
+                    f"_SAVE_ERROR_{now.strftime('%H%M%S')}.xlsm"
                 )
                 print(f"Attempting to save to alternate path: {alt_output_path}")
-                wb_template.save(alt_output_path)
+                wb_template.api.SaveCopyAs(alt_output_path)
+                saved_path = alt_output_path
                 print(f"Workbook saved to alternate path: {alt_output_path}")
             except Exception as alt_save_err:
                 print(f"!!! FAILED to save to alternate path: {alt_save_err}")
                 traceback.print_exc()
                 # Indicate that saving failed completely
 
+        # --- 9. Write Pivot Table to Saved Report ---
+        # Save-then-patch: the saved copy is not open in Excel, so openpyxl
+        # can rewrite it directly
+        if saved_path is not None and pivot_table is not None:
+            pivot_sheet_name = 'Pivot_Summary'
+            try:
+                write_pivot_sheet(saved_path, pivot_table, pivot_sheet_name)
+                print(f"Pivot Table written to '{pivot_sheet_name}' sheet.")
+            except Exception as pivot_write_err:
+                print(
+                    f"!!! ERROR writing Pivot Table to sheet: {pivot_write_err}"
+                )
+                traceback.print_exc()
+
     except Exception as e:
         # Catch any unexpected errors during the main process
         print("\n--- An Unexpected Error Occurred During Main Processing ---")
@@ -551,28 +696,14 @@ def main():
                 excel_app.calculation = 'automatic'
                 excel_app.screen_updating = True
                 excel_app.display_alerts = True
+                excel_app.api.EnableEvents = True
+                excel_app.api.EnableAnimations = True
             except Exception as setting_err:
                 print(f"Warning: Error restoring Excel settings: {setting_err}")
 
         # Close workbooks gracefully
-        if wb_source is not None: # Check if source was opened and not closed yet
-             try:
-                 wb_source.close()
-                 print("Closed source workbook (in finally block).")
-             except Exception as e:
-                 print(f"Error closing source workbook: {e}")
-
         if wb_template is not None:
-            was_saved = False
-            # Check if the primary output path exists to infer successful save
-            if 'output_path' in locals() and os.path.exists(output_path):
-                was_saved = True
-            if not was_saved:
-                # Check for the alternate save path as well
-                 if 'alt_output_path' in locals() and os.path.exists(alt_output_path):
-                     was_saved = True
-
-            if not was_saved:
+            if saved_path is None:
                  print("Warning: Template workbook may not have saved correctly.")
 
             try:
@@ -581,6 +712,14 @@ def main():
             except Exception as e:
                 print(f"Error closing template workbook: {e}")
 
+        # Remove the staging copy (only the saved report is kept)
+        if os.path.exists(staging_path):
+            try:
+                os.remove(staging_path)
+                print("Removed staging workbook.")
+            except Exception as e:
+                print(f"Error removing staging workbook {staging_path}: {e}")
+
         # Quit Excel application
         if excel_app is not None:
             try: